@@ -0,0 +1,358 @@
+"""
+_pprof.py — shared profile loading for heap-summary.py / compare-heaps.py
+             and goroutine-summary.py (binary profiles)
+
+Decodes the gzip'd `profile.proto` written by runtime/pprof directly, so the
+common case needs neither a Go toolchain nor a `go tool pprof -top` round-trip
+through text.  Only the handful of fields needed for flat per-function totals
+are decoded (sample_type, sample, location, function, string_table).
+
+Profiles the decoder does not understand (e.g. legacy text-format heap
+profiles from ?debug=1) raise UnsupportedProfileError internally and fall back
+to `go tool pprof -top`.
+"""
+
+import collections, gzip, hashlib, heapq, mmap, os, pathlib, shutil, subprocess, sys, re, tempfile
+
+###############################################################################
+# helpers
+###############################################################################
+class UnsupportedProfileError(Exception):
+    """Input is not a profile.proto we can decode natively."""
+
+def fatal(msg: str):
+    print("[ERROR]", msg, file=sys.stderr); sys.exit(1)
+
+_MB_FMT = "{:8.2f} MB".format          # bound once, not re-parsed per row
+def fmt(b): return _MB_FMT(b * (1/1048576))   # 2**-20: exact, same as /1024/1024
+
+def _varint(buf, pos: int):
+    """Decode one base-128 varint at pos → (value, new_pos)."""
+    result = shift = 0
+    while True:
+        b = buf[pos]; pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def _fields(buf, pos: int, end: int):
+    """
+    Yield (field_number, wire_type, value) for one message in buf[pos:end].
+    varint → int; length-delimited → (start, stop) offsets into buf.
+    """
+    while pos < end:
+        key = buf[pos]                            # tags < 16 are one byte
+        if key < 0x80: pos += 1
+        else: key, pos = _varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            val, pos = _varint(buf, pos)
+        elif wire == 2:
+            n = buf[pos]
+            if n < 0x80: pos += 1
+            else: n, pos = _varint(buf, pos)
+            val = (pos, pos + n); pos += n
+        elif wire == 1:
+            val = None; pos += 8
+        elif wire == 5:
+            val = None; pos += 4
+        else:
+            raise UnsupportedProfileError(f"unexpected wire type {wire}")
+        yield key >> 3, wire, val
+    if pos != end:
+        raise UnsupportedProfileError("truncated message")
+
+def _nth(buf, span, n: int) -> int:
+    """n-th element of a packed repeated varint field."""
+    pos, end = span
+    for _ in range(n):
+        _, pos = _varint(buf, pos)
+    if pos >= end: raise IndexError(n)
+    return _varint(buf, pos)[0]
+
+# one varint = any continuation bytes, then a byte with the top bit clear
+_varints = re.compile(rb"[\x80-\xff]*[\x00-\x7f]").findall
+
+def _sample(buf, start: int, stop: int, idx: int):
+    """(leaf location id, value[idx]) of one Sample message."""
+    # fast path for runtime/pprof's layout (proto.go pbSample): value (tag 2)
+    # first, then location_id (tag 1).  Go packs a repeated field only when
+    # it has more than two elements, so 1-2 values (goroutine, block) or a
+    # 1-2 frame stack arrive unpacked.  Only the leaf is decoded, and packed
+    # values are split by one C-level findall instead of a varint walk.
+    pos = start; value = None
+    if pos < stop and buf[pos] == 0x12:           # packed values
+        n, pos = _varint(buf, pos + 1)
+        if pos + n <= stop:
+            vals = _varints(buf, pos, pos + n); pos += n
+            if idx < len(vals):
+                value = _varint(vals[idx], 0)[0]
+    else:
+        i = 0
+        while pos < stop and buf[pos] == 0x10:    # unpacked values
+            v, pos = _varint(buf, pos + 1)
+            if i == idx: value = v
+            i += 1
+    if value is not None and pos < stop:
+        if buf[pos] == 0x0a:                      # packed locations
+            n, pos = _varint(buf, pos + 1)
+            if n and pos + n <= stop:
+                return _varint(buf, pos)[0], value
+        elif buf[pos] == 0x08:                    # unpacked: first is leaf
+            return _varint(buf, pos + 1)[0], value
+
+    leaf = value = None; seen = 0
+    for f, w, v in _fields(buf, start, stop):
+        if f not in (1, 2):
+            continue
+        if w not in (0, 2):                       # fixed64/fixed32: no span
+            raise UnsupportedProfileError(f"sample field {f} has wire type {w}")
+        if f == 1 and leaf is None:
+            leaf = v if w == 0 else _nth(buf, v, 0)
+        elif f == 2:
+            if w == 2:
+                value = _nth(buf, v, idx)
+            else:                                 # unpacked encoding
+                if seen == idx: value = v
+                seen += 1
+    return leaf, value
+
+def _stack(buf, start: int, stop: int, idx: int):
+    """(location ids leaf first, value[idx]) of one Sample message."""
+    locs = []; value = None; seen = 0
+    for f, w, v in _fields(buf, start, stop):
+        if f not in (1, 2):
+            continue
+        if w not in (0, 2):
+            raise UnsupportedProfileError(f"sample field {f} has wire type {w}")
+        if f == 1:
+            if w == 0:
+                locs.append(v)
+            else:
+                pos, end = v
+                while pos < end:
+                    loc, pos = _varint(buf, pos); locs.append(loc)
+        elif f == 2:
+            if w == 2:
+                value = _nth(buf, v, idx)
+            else:                                 # unpacked encoding
+                if seen == idx: value = v
+                seen += 1
+    return tuple(locs), value
+
+def find_heaps(root) -> list[pathlib.Path]:
+    """
+    Sorted *heap.prof files of the first directory under root (walked in
+    sorted order) that has any.  Hidden entries count too, as they did
+    with Path.glob("**/*heap.prof").  Stops there: no full-tree walk, no
+    sort of unrelated files.
+    """
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()                           # in place: walk order
+        hits = sorted(f for f in files if f.endswith("heap.prof"))
+        if hits:
+            return [pathlib.Path(dirpath, f) for f in hits]
+    return []
+
+###############################################################################
+# native decoder
+###############################################################################
+def load_profile(path, sample_type: str, skip: str = None) -> dict[str,int]:
+    """
+    Return {function: flat value} for sample_type (e.g. "inuse_space"),
+    decoded straight from the protobuf.  skip: see _flat.  Raises
+    UnsupportedProfileError.
+    """
+    with open(path, "rb") as fh:
+        if fh.read(2) != b"\x1f\x8b":            # not gzip magic
+            fh.seek(0)
+            data = fh.read()      # indexing bytes beats indexing an mmap
+        else:
+            # inflate straight from the mapped file; the compressed copy
+            # never lands on the Python heap
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                try:
+                    data = gzip.decompress(mm)
+                except (OSError, EOFError) as exc:
+                    raise UnsupportedProfileError(f"bad gzip stream: {exc}")
+    try:
+        return _flat(data, sample_type, skip)
+    except (IndexError, ValueError) as exc:
+        raise UnsupportedProfileError(f"not a profile.proto ({exc})")
+
+def _flat(buf: bytes, sample_type: str, skip: str = None) -> dict[str,int]:
+    """
+    Flat value per leaf function or, with skip, per first frame whose
+    function name does not start with skip (e.g. "runtime.").
+    """
+    types, samples, strings = [], [], []
+    loc_func, loc_addr, func_name = {}, {}, {}
+
+    for field, wire, val in _fields(buf, 0, len(buf)):
+        if wire != 2:
+            continue
+        if field == 2:                            # Sample
+            samples.append(val)
+        elif field == 1:                          # ValueType
+            types.append(next((v for f, w, v in _fields(buf, *val)
+                               if f == 1 and w == 0), 0))
+        elif field == 4:                          # Location
+            loc_id = addr = 0; fn_ids = []
+            for f, w, v in _fields(buf, *val):
+                if f == 1 and w == 0:
+                    loc_id = v
+                elif f == 3 and w == 0:
+                    addr = v
+                elif f == 4 and w == 2:
+                    # lines run innermost (possibly inlined) frame first;
+                    # line[0] is what `pprof -top` reports as flat
+                    fn_id = next((lv for lf, lw, lv in _fields(buf, *v)
+                                  if lf == 1 and lw == 0), None)
+                    if fn_id is not None:
+                        fn_ids.append(fn_id)
+            loc_func[loc_id] = fn_ids
+            loc_addr[loc_id] = addr
+        elif field == 5:                          # Function
+            fn_id = name = 0
+            for f, w, v in _fields(buf, *val):
+                if f == 1 and w == 0: fn_id = v
+                elif f == 2 and w == 0: name = v
+            func_name[fn_id] = name
+        elif field == 6:                          # string_table
+            strings.append(bytes(buf[val[0]:val[1]]).decode(errors="replace"))
+
+    names = [strings[i] for i in types]
+    if sample_type not in names:
+        raise UnsupportedProfileError(
+            f"sample type {sample_type!r} not in profile {names}")
+    idx = names.index(sample_type)
+
+    def frames(loc) -> list[str]:
+        fn_ids = loc_func.get(loc)
+        if not fn_ids:
+            return [f"{loc_addr.get(loc, 0):#x}"]  # unsymbolized
+        return [strings[func_name.get(fn_id, 0)] for fn_id in fn_ids]
+
+    # sum per leaf location (or whole stack) first: many samples share one
+    per_key = collections.defaultdict(int)
+    for start, stop in samples:
+        if skip is None:
+            key, value = _sample(buf, start, stop, idx)
+        else:
+            key, value = _stack(buf, start, stop, idx)
+        if key and value:
+            if value >= 1 << 63:                  # int64 two's complement
+                value -= 1 << 64
+            per_key[key] += value
+
+    out = collections.defaultdict(int)
+    for key, value in per_key.items():
+        if skip is None:
+            name = frames(key)[0]
+        else:
+            chain = [fn for loc in key for fn in frames(loc)]
+            # all-skipped stacks are named by their outermost frame, the
+            # function the goroutine was started with
+            name = next((fn for fn in chain if not fn.startswith(skip)),
+                        chain[-1])
+        out[name] += value
+    return dict(out)
+
+###############################################################################
+# `go tool pprof` fallback
+###############################################################################
+_cache_dir = pathlib.Path(tempfile.gettempdir()) / "pprof-cache"
+
+def _cache_key(profile, metric: str, go: str) -> str:
+    """sha1(profile) + metric + go binary identity (upgrades invalidate)."""
+    with open(profile, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest = hashlib.sha1(mm)        # hashed in place, no copy
+        else:
+            digest = hashlib.sha1()
+    st = os.stat(go)
+    digest.update(f"{os.path.realpath(go)}:{st.st_mtime_ns}".encode())
+    return f"{digest.hexdigest()}_{metric}"
+
+def call_pprof(profile, metric: str) -> bytes:
+    """Return raw `go tool pprof -top` output sorted by metric (cached on disk)."""
+    go = shutil.which("go")
+    if go is None:
+        fatal("Go toolchain not in PATH")
+    cached = _cache_dir / _cache_key(profile, metric, go)
+    if cached.exists():
+        return cached.read_bytes()
+    cmd = [
+        "go","tool","pprof",
+        "-top",
+        f"-{metric}",
+        # every row is needed: package totals and deltas cover functions
+        # outside any top-N, so a top*k node count would be wrong here
+        "--nodecount=99999",
+        profile
+    ]
+    try:
+        # kept as bytes: the regexes below are bytes patterns, so a multi-MB
+        # UTF-8 decode of ASCII output would be wasted work
+        out = subprocess.check_output(cmd, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as exc:
+        fatal(f"go tool pprof failed on {profile}:\n"
+              f"{exc.stderr.decode(errors='replace')}")
+    try:
+        _cache_dir.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=_cache_dir,
+                                         delete=False) as tmp:
+            tmp.write(out)
+        os.replace(tmp.name, cached)             # atomic: no torn reads
+    except OSError:
+        pass                                     # cache is best-effort
+    return out
+
+# extract "bytes  func" rows: flat flat% sum% cum cum% name [(inline)]
+# — one token per column, no `.*`, so non-matching lines fail fast.
+# bytes patterns skip the unicode machinery; -top output is plain ASCII.
+# Columns are space-separated; `\s` would let a match run across lines.
+row_re = re.compile(
+    rb"^ *([0-9.]+)([kMG]?B) +\S+% +\S+% +\S+ +\S+% +(\S+)(?: \(inline\))?$",
+    re.MULTILINE)
+# power-of-1024 shift keyed by the unit's first byte (B k M G): one indexed
+# load instead of hashing the unit for a dict lookup.  'B' and all else → 0.
+_SHIFT = bytearray(256)
+_SHIFT[ord("k")], _SHIFT[ord("M")], _SHIFT[ord("G")] = 10, 20, 30
+_SHIFT = bytes(_SHIFT)
+_SCALE = tuple(10**i for i in range(8))        # by count of decimal digits
+
+def to_bytes(num: bytes, unit: bytes) -> int:
+    """b"512.17", b"MB" → 537049169, without going through float."""
+    whole, _, frac = num.partition(b".")
+    return (int(whole + frac) << _SHIFT[unit[0]]) // _SCALE[len(frac)]
+
+def parse_pprof(out: bytes) -> dict[str,int]:
+    return {m.group(3).decode(): to_bytes(m.group(1), m.group(2))
+            for m in row_re.finditer(out)}
+
+###############################################################################
+# entry point
+###############################################################################
+def flat(profile, metric: str) -> dict[str,int]:
+    """{function: flat bytes} — native decode, `go tool pprof` if we must."""
+    try:
+        return load_profile(profile, metric)
+    except UnsupportedProfileError as exc:
+        print(f"[WARN ] {profile}: {exc}; falling back to `go tool pprof -top`",
+              file=sys.stderr)
+        return parse_pprof(call_pprof(profile, metric))
+
+def top(profile, metric: str, n: int,
+        skip: str = None) -> tuple[int, list[tuple[int,str]]]:
+    """
+    (total, [(value, function), ...] for the n largest) — native decode
+    only; raises UnsupportedProfileError so the caller picks its fallback.
+    With skip, samples are grouped by their first frame not starting with
+    skip instead of by leaf function.
+    """
+    values = load_profile(profile, metric, skip)
+    return (sum(values.values()),
+            heapq.nlargest(n, ((v, fn) for fn, v in values.items())))
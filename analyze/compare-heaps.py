@@ -6,14 +6,18 @@ compare-heaps.py  old_path  new_path  [--allocs]
       • a heap.prof file
       • a directory containing one (first match is used)
 
-* Shows functions with the largest positive delta (growth) between profiles.
+* Shows functions with the largest positive delta (growth) between profiles,
+  and the largest negative one (shrink), including functions that vanished.
 
 Options
 -------
   --allocs   compare cumulative allocation bytes (default = live in-use heap)
 """
 
-import argparse, collections, pathlib, shutil, subprocess, sys, re
+import argparse, heapq, pathlib, sys
+from concurrent.futures import ProcessPoolExecutor
+
+import _pprof
 
 ###############################################################################
 # helpers
@@ -25,7 +29,7 @@ def resolve_heap(path: pathlib.Path) -> pathlib.Path:
     if path.is_file():
         return path
     if path.is_dir():
-        matches = sorted(path.glob("**/*heap.prof"))
+        matches = _pprof.find_heaps(path)
         if not matches:
             fatal(f"No *heap.prof in {path}")
         if len(matches) > 1:
@@ -33,73 +37,75 @@ def resolve_heap(path: pathlib.Path) -> pathlib.Path:
         return matches[0]
     fatal(f"{path} is neither file nor directory")
 
-def call_pprof(profile: pathlib.Path, metric: str) -> str:
-    """Return `go tool pprof -top` output sorted by metric."""
-    if shutil.which("go") is None:
-        fatal("Go toolchain not in PATH")
-    cmd = [
-        "go","tool","pprof",
-        "-top",
-        f"-{metric}",
-        "--nodecount=99999",
-        profile
-    ]
-    try:
-        return subprocess.check_output(cmd, text=True, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as exc:
-        fatal(f"go tool pprof failed on {profile}:\n{exc.stderr}")
-
-# extract "bytes  func" rows
-row_re = re.compile(r"^\s*([0-9.]+)([kMG]?B)\s+.*\s+(\S+)$")
-unit_mult = {"kB":1024,"MB":1024**2,"GB":1024**3}
-
-def to_bytes(num: str, unit: str) -> int:
-    return int(float(num)*unit_mult.get(unit,1))
-
-def parse_pprof(text: str) -> dict[str,int]:
-    m = {}
-    for line in text.splitlines():
-        r = row_re.match(line)
-        if not r: continue
-        b = to_bytes(r.group(1), r.group(2))
-        func = r.group(3)
-        m[func] = b
-    return m
-
-def fmt(b): return f"{b/1024/1024:8.2f} MB"
+def deltas(old_map: dict[str,int], new_map: dict[str,int]):
+    """
+    Yield (func, new - old) over both profiles while draining old_map, so
+    no delta/union map is built; leftovers are functions that vanished.
+    """
+    for fn, new_b in new_map.items():
+        yield fn, new_b - old_map.pop(fn, 0)
+    for fn, old_b in old_map.items():
+        yield fn, -old_b
+
+def top_moves(diffs, n: int):
+    """
+    One pass, two bounded min-heaps: the n biggest growths and the n
+    biggest shrinks, each largest-first.  Ties keep first-seen order.
+    """
+    grow, shrink = [], []
+    if n <= 0:
+        return grow, shrink
+    for i, (fn, diff) in enumerate(diffs):
+        if diff == 0:
+            continue
+        heap = grow if diff > 0 else shrink
+        item = (abs(diff), -i, fn)
+        if len(heap) < n:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return ([(fn, d) for d, _, fn in sorted(grow, reverse=True)],
+            [(fn, -d) for d, _, fn in sorted(shrink, reverse=True)])
 
 ###############################################################################
 # CLI
 ###############################################################################
-parser = argparse.ArgumentParser()
-parser.add_argument("old", type=pathlib.Path)
-parser.add_argument("new", type=pathlib.Path)
-parser.add_argument("--allocs", action="store_true",
-                    help="compare allocation bytes instead of live heap")
-parser.add_argument("--top", type=int, default=20,
-                    help="rows to show (default 20)")
-args = parser.parse_args()
-
-metric = "alloc_space" if args.allocs else "inuse_space"
-old_heap = resolve_heap(args.old)
-new_heap = resolve_heap(args.new)
-
-print("[INFO ] comparing", old_heap, "→", new_heap,
-      f"using metric {metric}")
-
-old_map = parse_pprof(call_pprof(old_heap, metric))
-new_map = parse_pprof(call_pprof(new_heap, metric))
-
-delta = collections.Counter()
-for fn, new_b in new_map.items():
-    delta[fn] = new_b - old_map.get(fn, 0)
-
-print("\nTop growth:")
-for fn, diff in delta.most_common(args.top):
-    if diff <= 0: break
-    print(f"  +{fmt(diff)}  {fn}")
-
-print("\nTop shrink:")
-for fn, diff in delta.most_common()[:args.top][::-1]:
-    if diff >= 0: continue
-    print(f"  {fmt(diff)}  {fn}")
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=pathlib.Path)
+    parser.add_argument("new", type=pathlib.Path)
+    parser.add_argument("--allocs", action="store_true",
+                        help="compare allocation bytes instead of live heap")
+    parser.add_argument("--top", type=int, default=20,
+                        help="rows to show (default 20)")
+    args = parser.parse_args()
+
+    metric = "alloc_space" if args.allocs else "inuse_space"
+    old_heap = resolve_heap(args.old)
+    new_heap = resolve_heap(args.new)
+
+    print("[INFO ] comparing", old_heap, "→", new_heap,
+          f"using metric {metric}")
+
+    # the native decoder is pure Python and holds the GIL, so each load gets
+    # its own process; flat() is module-level and its args and result pickle
+    with ProcessPoolExecutor(2) as ex:
+        fo = ex.submit(_pprof.flat, old_heap, metric)
+        fn = ex.submit(_pprof.flat, new_heap, metric)
+        old_map = fo.result()
+        new_map = fn.result()
+
+    # old_map is consumed: memory is both loaded maps plus 2 x top heap entries
+    growth, shrinkage = top_moves(deltas(old_map, new_map), args.top)
+
+    print("\nTop growth:")
+    for fn, diff in growth:
+        print(f"  +{_pprof.fmt(diff)}  {fn}")
+
+    print("\nTop shrink:")
+    for fn, diff in shrinkage:
+        print(f"  {_pprof.fmt(diff)}  {fn}")
+
+# guarded: spawn-start workers (macOS, Windows) re-import this script
+if __name__ == "__main__":
+    main()
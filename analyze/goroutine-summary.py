@@ -7,28 +7,91 @@ Quick-look diagnostics for goroutine dumps captured via
 or
   curl ... /debug/pprof/goroutine           (binary)
 
-If the input is gzip-compressed it is transparently decompressed.
+If the input is gzip-compressed it is transparently decompressed.  Binary
+profiles are decoded natively (no scheduler states; goroutines are grouped
+by their first non-`runtime.` frame, much like the debug=2 signature);
+`go tool pprof -top` is only used if that fails.
+
+Options
+-------
+  -j N   inflate gzip input with ISA-L on a background thread while the
+         main thread scans (N > 1, needs `pip install isal`)
 """
 
-import sys, re, gzip, collections, io, os, subprocess, shutil
+import argparse, sys, re, gzip, collections, io, mmap, operator, os, subprocess, shutil
+
+import _pprof
+
+try:                       # optional: ISA-L threaded inflate for -j
+    from isal import igzip_threaded
+except ImportError:
+    igzip_threaded = None
 
 TOP_N = 15
 
 ###############################################################################
 # helpers
 ###############################################################################
-def read_profile(path: str) -> bytes:
-    """Return raw bytes, transparently handling gzip."""
+def read_profile(path: str, jobs: int = 1):
+    """
+    Return the dump as a read-only mmap (plain files: scanned in place,
+    never copied) or as a buffered stream for gzip input.
+    """
     with open(path, "rb") as fh:
-        magic = fh.peek(2) if hasattr(fh, "peek") else fh.read(2)
-        fh.seek(0)
-        data = fh.read()
-        if magic.startswith(b"\x1f\x8b"):  # gzip magic
-            return gzip.decompress(data)
-        return data
-
-def is_text_stack(blob: bytes) -> bool:
-    return b"goroutine " in blob and b"\n" in blob
+        magic = fh.read(2)
+        if magic == b"\x1f\x8b":  # gzip magic
+            if jobs > 1 and igzip_threaded is not None:
+                # deflate is serial, but ISA-L drops the GIL, so a reader
+                # thread overlaps inflate with the regex scan below
+                return igzip_threaded.open(path, "rb", threads=jobs - 1)
+            return gzip.open(path, "rb")
+        if magic:                  # mmap cannot map an empty file
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    return open(path, "rb")
+
+def is_text_stack(src) -> bool:
+    # GzipFile and BufferedReader both peek
+    head = src[:4096] if isinstance(src, mmap.mmap) else src.peek(4096)
+    return b"goroutine " in head and b"\n" in head
+
+# 'goroutine N [state]:' header plus the first frame after it, both already
+# trimmed: state stops at the first ',' ("chan receive, 5 minutes").  A group
+# is empty if the state has unexpected chars or the stack has no frames (a
+# truncated dump may even end on a bare header with no newline).  No
+# leading `^`, so sre can skip ahead on the literal "goroutine " prefix.
+# Bytes pattern: works on mmap directly and nothing is decoded until output.
+stack_re = re.compile(
+    rb"goroutine \d+ \[(?:([A-Za-z0-9 _]+?) *(?:,[A-Za-z0-9 _,]*)?\]:)?[^\n]*(?:\n|\Z)"
+    rb"(?:[ \t]*\n)*(?:(?!goroutine \d+ \[)[ \t]*([^\n]*\S))?")
+CHUNK = 1 << 20
+
+def scan_stacks(src):
+    """
+    Yield one list of (state, first_frame) byte tuples per ~CHUNK of input.
+    Chunks are cut before their last header, so no stack straddles two scans.
+    """
+    if isinstance(src, mmap.mmap):
+        # windows over the mapping via pos/endpos: no slicing, no copies
+        pos, size = 0, len(src)
+        while pos < size:
+            cut = src.rfind(b"\ngoroutine ", pos, pos + CHUNK) + 1
+            if pos + CHUNK >= size:
+                cut = size
+            elif cut <= pos:       # one stack longer than CHUNK
+                cut = src.find(b"\ngoroutine ", pos + CHUNK) + 1 or size
+            yield stack_re.findall(src, pos, cut)
+            pos = cut
+        return
+
+    carry = b""
+    while True:
+        block = src.read(CHUNK)
+        buf = carry + block
+        cut = buf.rfind(b"\ngoroutine ") + 1 if block else len(buf)
+        yield stack_re.findall(buf, 0, cut)
+        if not block:
+            return
+        carry = buf[cut:]
 
 def fatal(msg: str):
     print(f"[ERROR] {msg}", file=sys.stderr)
@@ -37,43 +100,58 @@ def fatal(msg: str):
 ###############################################################################
 # main
 ###############################################################################
-if len(sys.argv) != 2:
-    fatal("Usage: goroutine-summary.py <goroutine.prof>")
-
-raw = read_profile(sys.argv[1])
-
-if not is_text_stack(raw):
-    print("[WARN ] input looks binary; falling back to `go tool pprof -top`")
-    if shutil.which("go") is None:
-        fatal("Go toolchain not in PATH; cannot parse binary pprof")
-    # Print top of the binary profile, then exit
-    subprocess.run(["go", "tool", "pprof", "-top", sys.argv[1]])
+parser = argparse.ArgumentParser()
+parser.add_argument("profile", help="goroutine dump (?debug=2 text or binary)")
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="threads for gzip inflate (default 1, needs isal)")
+args = parser.parse_args()
+
+if args.jobs > 1 and igzip_threaded is None:
+    print("[WARN ] -j needs python-isal (`pip install isal`); ignoring")
+
+src = read_profile(args.profile, args.jobs)
+
+if not is_text_stack(src):
+    src.close()
+    try:
+        # nearly every parked goroutine's leaf is runtime.gopark, so group
+        # by the first frame outside the runtime instead
+        total, rows = _pprof.top(args.profile, "goroutine", TOP_N,
+                                 skip="runtime.")
+    except _pprof.UnsupportedProfileError as exc:
+        print(f"[WARN ] {exc}; falling back to `go tool pprof -top`")
+        if shutil.which("go") is None:
+            fatal("Go toolchain not in PATH; cannot parse binary pprof")
+        # Print top of the binary profile, then exit; only TOP_N rows are
+        # wanted, so let pprof trim instead of emitting every node
+        subprocess.run(["go", "tool", "pprof", "-top", f"-nodecount={TOP_N}",
+                        args.profile])
+        sys.exit(0)
+
+    print(f"\nTotal goroutines: {total}\n")
+    print(f"Top {TOP_N} stack signatures "
+          "(first non-runtime frame; binary profile: no scheduler states):")
+    for cnt, fn in rows:
+        pct = cnt / total * 100
+        print(f"{cnt:>4} ({pct:5.1f}%)  {fn}")
     sys.exit(0)
 
 # --- text mode --------------------------------------------------------------
-text = raw.decode(errors="replace")
-
-# split at 'goroutine N ['   (keep state token inside bracket)
-stacks = re.split(r"goroutine \d+ \[", text)[1:]
-
-if not stacks:
-    fatal("no goroutine stacks found (did you pass ?debug=2 output?)")
-
-total = len(stacks)
-state_re = re.compile(r"^([A-Za-z0-9 _,]+)\]:")
+total  = 0
 states = collections.Counter()
 sigs   = collections.Counter()
+state_of, frame_of = operator.itemgetter(0), operator.itemgetter(1)
 
-for stack in stacks:
-    # state = first line up to ']:'
-    m = state_re.match(stack)
-    if m:
-        state = m.group(1).split(',')[0].strip()
-        states[state] += 1
-    # first frame after the blank line = unique signature
-    lines = [l for l in stack.splitlines() if l]
-    if len(lines) > 1:
-        sigs[lines[1].strip()] += 1
+with src:
+    for found in scan_stacks(src):
+        total += len(found)
+        # Counter.update(iterable) counts in C; keys stay bytes and only
+        # the rows actually printed get decoded
+        states.update(filter(None, map(state_of, found)))
+        sigs.update(filter(None, map(frame_of, found)))
+
+if not total:
+    fatal("no goroutine stacks found (did you pass ?debug=2 output?)")
 
 ###############################################################################
 # output
@@ -83,10 +161,10 @@ print(f"\nTotal goroutines: {total}\n")
 print("By scheduler state:")
 for st, cnt in states.most_common():
     pct = cnt / total * 100
-    print(f"  {st:<12} {cnt:>6}  ({pct:5.1f}%)")
+    print(f"  {st.decode(errors='replace'):<12} {cnt:>6}  ({pct:5.1f}%)")
 print()
 
 print(f"Top {TOP_N} stack signatures:")
 for sig, cnt in sigs.most_common(TOP_N):
     pct = cnt / total * 100
-    print(f"{cnt:>4} ({pct:5.1f}%)  {sig}")
+    print(f"{cnt:>4} ({pct:5.1f}%)  {sig.decode(errors='replace')}")
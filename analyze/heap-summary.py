@@ -2,10 +2,13 @@
 """
 Enhanced heap-summary.py
   • Accepts a heap.prof file *or* a directory containing one
-  • Informs you when go tool pprof fails and shows stderr
+  • Decodes the profile natively; go tool pprof only as a fallback
   • Retains --allocs, --top, --json features
 """
-import argparse, json, shutil, subprocess, tempfile, pathlib, sys, re, collections, os, glob, textwrap
+import argparse, json, pathlib, sys, textwrap
+import heapq, operator
+
+import _pprof
 
 TOP_DEFAULT = 15
 
@@ -18,7 +21,7 @@ def resolve_profile(path: pathlib.Path) -> pathlib.Path:
     if path.is_file():
         return path
     if path.is_dir():
-        matches = sorted(path.glob("**/*heap.prof"))
+        matches = _pprof.find_heaps(path)
         if not matches:
             fatal(f"No *heap.prof found inside {path}")
         if len(matches) > 1:
@@ -29,35 +32,6 @@ def resolve_profile(path: pathlib.Path) -> pathlib.Path:
         return matches[0]
     fatal(f"{path} is neither file nor directory")
 
-def run_pprof(profile: pathlib.Path, metric: str) -> str:
-    """
-    metric = "inuse_space" | "alloc_space"
-    Uses only one output format (-top) so Go ≤1.21 is happy.
-    """
-    if shutil.which("go") is None:
-        fatal("Go toolchain not in PATH (`go` command missing)")
-
-    cmd = [
-        "go", "tool", "pprof",
-        "-top",
-        f"-{metric}",          # -inuse_space or -alloc_space
-        "--nodecount=99999",
-        profile
-    ]
-    try:
-        return subprocess.check_output(cmd, text=True, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as exc:
-        print("[ERROR] go tool pprof failed:")
-        print(exc.stderr.strip())
-        sys.exit(1)
-
-size_re = re.compile(r"([0-9.]+)([kMG]?B)")
-
-def to_bytes(val: str) -> int:
-    num, unit = size_re.match(val).groups()
-    mult = {"kB":1024,"MB":1024**2,"GB":1024**3}.get(unit,1)
-    return int(float(num)*mult)
-
 # ────────────────────────────────────────────────────────────────────────────
 parser = argparse.ArgumentParser(
     formatter_class=argparse.RawTextHelpFormatter,
@@ -79,32 +53,22 @@ args = parser.parse_args()
 
 profile_file = resolve_profile(args.profile)
 metric = "alloc_space" if args.allocs else "inuse_space"
-pprof_txt = run_pprof(profile_file, metric)
+flat_map = _pprof.flat(profile_file, metric)
 
-# parse totals from header
-total_live = total_idle = None
-for line in pprof_txt.splitlines():
-    if line.startswith("Total:"):
-        nums = size_re.findall(line)
-        if len(nums) >= 2:
-            total_live, total_idle = (to_bytes("".join(n)) for n in nums[:2])
-        break
+# every sample has exactly one leaf function, so flat values sum to the
+# total; only meaningful as an in-use figure, so left unset for --allocs
+total_live = None if args.allocs else sum(flat_map.values()) or None
+total_idle = None
 
-func_rows, pkg_rows = [], collections.Counter()
-table_re = re.compile(r"^\s*([0-9.]+[kMG]?B).*\s+(\S+)$")
+# values()/keys() are parallel views: no per-row (bytes, fn) list to build
+func_rows = heapq.nlargest(args.top, zip(flat_map.values(), flat_map))
 
-for row in pprof_txt.splitlines():
-    m = table_re.match(row)
-    if not m: continue
-    bytes_ = to_bytes(m.group(1))
-    fn = m.group(2)
-    func_rows.append((bytes_, fn))
+pkg_rows = {}
+for fn, bytes_ in flat_map.items():
     pkg = fn.split("/")[0] if "/" in fn else fn.split(".")[0]
-    pkg_rows[pkg] += bytes_
+    pkg_rows[pkg] = pkg_rows.get(pkg, 0) + bytes_
 
-func_rows.sort(reverse=True)
-func_rows = func_rows[:args.top]
-pkg_rows  = pkg_rows.most_common(args.top)
+pkg_rows  = heapq.nlargest(args.top, pkg_rows.items(), key=operator.itemgetter(1))
 
 # ─────────────────────────────── output ────────────────────────────────────
 if args.json:
@@ -119,15 +83,13 @@ if args.json:
     json.dump(out, sys.stdout, indent=2)
     sys.exit(0)
 
-def fmt(b): return f"{b/1024/1024:8.2f} MB"
-
 print(f"\nHeap profile: {profile_file}")
 print(" Mode :", "allocation bytes" if args.allocs else "live in-use heap")
 if total_live:
-    print(" Heap :", fmt(total_live), "in-use  (idle ignored)")
+    print(" Heap :", _pprof.fmt(total_live), "in-use  (idle ignored)")
 print("\nTop functions:")
 for b, fn in func_rows:
-    print(f"  {fmt(b)}  {fn}")
+    print(f"  {_pprof.fmt(b)}  {fn}")
 print("\nTop packages:")
 for p, b in pkg_rows:
-    print(f"  {fmt(b)}  {p}")
+    print(f"  {_pprof.fmt(b)}  {p}")